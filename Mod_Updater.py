@@ -1,8 +1,16 @@
 import json
+import re
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+import urllib3.exceptions
 import os
+import shutil
+import socket
 import time
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 from tkinter.ttk import Combobox
@@ -10,6 +18,22 @@ from collections import Counter
 from urllib.parse import urlparse
 import logging
 
+# Use orjson for faster JSON parsing and writing when it's installed, falling back to the standard library
+try:
+    import orjson
+
+    def json_loads(data):
+        return orjson.loads(data)
+
+    def json_dumps(obj):
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+except ImportError:
+    def json_loads(data):
+        return json.loads(data)
+
+    def json_dumps(obj):
+        return json.dumps(obj, indent=2).encode("utf-8")
+
 # Configure logging for debugging
 logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s")
 
@@ -25,44 +49,134 @@ def setup_debug_logging():
     )
     logging.debug("Debug logging initialized.")
 
+# Shared HTTP session so connections to the Modrinth API and CDN are kept alive and reused
+SESSION = requests.Session()
+# Transient failures and rate-limit responses are retried with exponential backoff, honouring Retry-After
+RETRY_POLICY = Retry(
+    total=3,
+    backoff_factor=1,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True
+)
+SESSION.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=RETRY_POLICY))
+SESSION.headers["User-Agent"] = "Larson-Logan/Minecraft-Mod-Updater"
+
+# Number of mods processed in parallel; kept low to respect Modrinth's 300 requests/minute limit
+DEFAULT_MAX_WORKERS = 4
+MAX_WORKERS_LIMIT = 8
+
+# Token bucket used to pace requests to the Modrinth API across all worker threads
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate  # Tokens added per second
+        self.capacity = capacity  # Maximum burst size
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Block until a token is available, then consume it
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(wait_time)
+
+# Modrinth allows 300 requests per minute, i.e. 5 per second sustained
+MODRINTH_RATE_LIMITER = TokenBucket(rate=5.0, capacity=10)
+
+# Hosts contacted during a run: the Modrinth API and the CDN serving the mod files
+MODRINTH_HOSTS = ("api.modrinth.com", "cdn.modrinth.com")
+
+# Mod list URLs must be http(s) with a host
+URL_PATTERN = re.compile(r"^https?://[^/\s]+", re.IGNORECASE)
+
+# GUI updates from the download thread are applied in batches on this interval
+UI_DRAIN_INTERVAL_MS = 100
+UI_DRAIN_BATCH_SIZE = 256
+
+# Resolved mod versions are cached in the save directory so re-runs don't query the API again
+CACHE_FILENAME = ".modrinth_cache.json"
+CACHE_TTL_SECONDS = 6 * 60 * 60  # Re-resolve after six hours so new releases are still picked up
+
 # Function to download a mod file from a given URL and save it to a specified path
 # Metadata is added to the file for additional information
 def download_mod(download_url, save_path, metadata):
-    retries = 3  # Number of retry attempts for network issues
-    for attempt in range(retries):
-        try:
-            # Send a GET request to the URL with a timeout
-            response = requests.get(download_url, stream=True, timeout=10)
-            response.raise_for_status()  # Raise an error for unsuccessful status codes
-            with open(save_path, "wb") as file:
-                # Write the content of the file in chunks to handle large files
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            # Save metadata
-            metadata_path = f"{save_path}.meta.json"
-            with open(metadata_path, "w") as meta_file:
-                json.dump(metadata, meta_file, indent=4)
-            logging.debug(f"Downloaded file saved to: {save_path}, metadata saved to: {metadata_path}")
-            return  # Exit the function if download succeeds
-        except requests.exceptions.ConnectionError:
-            logging.error("Network connection error during download.")
-            if attempt < retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
-                continue
-            raise Exception("Network connection error while trying to download the file.")
-        except requests.exceptions.Timeout:
-            logging.error("Timeout occurred during download.")
-            if attempt < retries - 1:
-                time.sleep(2 ** attempt)  # Exponential backoff
-                continue
-            raise Exception("The request timed out while trying to download the file.")
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request exception during download: {e}")
-            raise Exception(f"An error occurred during the request: {e}")
+    attempts = RETRY_POLICY.total + 1
+    try:
+        # The session only retries up to the response headers, so a stall while reading the body is retried here
+        for attempt in range(attempts):
+            try:
+                # Send a GET request to the URL with a timeout; the session retries transient failures
+                # The response is closed on exit so its pooled connection is released even if the download fails
+                with SESSION.get(download_url, stream=True, timeout=10) as response:
+                    response.raise_for_status()  # Raise an error for unsuccessful status codes
+                    # Write to a temporary file first so an interrupted download never leaves a truncated jar
+                    temp_path = f"{save_path}.part"
+                    try:
+                        with open(temp_path, "wb") as file:
+                            # Stream the body straight to disk in 1 MB blocks to handle large files
+                            response.raw.decode_content = True
+                            shutil.copyfileobj(response.raw, file, length=1024 * 1024)
+                        os.replace(temp_path, save_path)
+                    finally:
+                        if os.path.exists(temp_path):
+                            os.remove(temp_path)
+                break
+            except (urllib3.exceptions.ReadTimeoutError, urllib3.exceptions.ProtocolError) as e:
+                if attempt == attempts - 1:
+                    raise
+                logging.warning(f"Download interrupted ({e}), retrying: {download_url}")
+                time.sleep(RETRY_POLICY.backoff_factor * 2 ** attempt)  # Exponential backoff
+        # Save metadata
+        metadata_path = f"{save_path}.meta.json"
+        with open(metadata_path, "wb") as meta_file:
+            meta_file.write(json_dumps(metadata))
+        logging.debug(f"Downloaded file saved to: {save_path}, metadata saved to: {metadata_path}")
+    # Errors while streaming the body come straight from urllib3, since response.raw bypasses requests' wrapping
+    except (requests.exceptions.ConnectionError, urllib3.exceptions.ProtocolError):
+        logging.error("Network connection error during download.")
+        raise Exception("Network connection error while trying to download the file.")
+    except (requests.exceptions.Timeout, urllib3.exceptions.ReadTimeoutError):
+        logging.error("Timeout occurred during download.")
+        raise Exception("The request timed out while trying to download the file.")
+    except (requests.exceptions.RequestException, urllib3.exceptions.HTTPError) as e:
+        logging.error(f"Request exception during download: {e}")
+        raise Exception(f"An error occurred during the request: {e}")
+
+# Function to extract the Modrinth project slug from a mod list URL (e.g. https://modrinth.com/mod/sodium)
+# Returns None for URLs that don't point at a Modrinth project
+def get_modrinth_slug(mod_url):
+    parsed = urlparse(mod_url)
+    if parsed.netloc not in ("modrinth.com", "www.modrinth.com"):
+        return None
+    path_parts = [part for part in parsed.path.split("/") if part]
+    if len(path_parts) < 2:
+        return None
+    return path_parts[1]
 
 # Function to retrieve the download URL of a mod from the Modrinth API
 # Returns the URL, version information, and other metadata
-def get_download_url_modrinth(mod_name, mod_loader, mc_version):
+# If the project ID or slug is already known, the search request is skipped
+# When a cache is given, fresh entries are returned directly and stale ones are revalidated with their ETag
+# Cache entries are keyed by the mod list URL as well as the name, so editing an entry's URL re-resolves it
+def get_download_url_modrinth(mod_name, mod_loader, mc_version, project_id=None, cache=None, mod_url=None):
+    cache_key = f"{mod_name}|{mod_url}|{mod_loader}|{mc_version}"
+    entry = cache.get(cache_key) if cache is not None else None
+    if entry and time.time() - entry["resolved_at"] < CACHE_TTL_SECONDS:
+        logging.debug(f"Using cached resolution for: {mod_name}")
+        return entry["file_url"], None, entry["metadata"]
+    request_headers = {}
+    if entry:
+        project_id = entry["project_id"]
+        if entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
     base_url = "https://api.modrinth.com/v2"
     search_url = f"{base_url}/search"
     query_params = {
@@ -70,18 +184,30 @@ def get_download_url_modrinth(mod_name, mod_loader, mc_version):
         "facets": f"[[\"categories:{mod_loader}\", \"versions:{mc_version}\"]]"
     }
     try:
-        # Search for the mod using the Modrinth API
-        response = requests.get(search_url, params=query_params, timeout=10)
-        response.raise_for_status()
-        results = response.json()["hits"]
-        if not results:
-            logging.debug(f"No matching mod found for: {mod_name}")
-            return None, "No matching mod found.", None
-        # Get the project ID and retrieve version details
-        project_id = results[0]["project_id"]
+        if project_id is None:
+            # Search for the mod using the Modrinth API
+            MODRINTH_RATE_LIMITER.acquire()
+            response = SESSION.get(search_url, params=query_params, timeout=10)
+            response.raise_for_status()
+            results = response.json()["hits"]
+            if not results:
+                logging.debug(f"No matching mod found for: {mod_name}")
+                return None, "No matching mod found.", None
+            project_id = results[0]["project_id"]
+        # Retrieve version details, letting the API filter by mod loader and Minecraft version
         versions_url = f"{base_url}/project/{project_id}/version"
-        version_response = requests.get(versions_url, timeout=10)
+        version_params = {
+            "loaders": json.dumps([mod_loader]),
+            "game_versions": json.dumps([mc_version])
+        }
+        MODRINTH_RATE_LIMITER.acquire()
+        version_response = SESSION.get(versions_url, params=version_params, headers=request_headers, timeout=10)
         version_response.raise_for_status()
+        if version_response.status_code == 304:
+            # Nothing changed since the last run, so the cached version is still the right one
+            logging.debug(f"Cached resolution still valid for: {mod_name}")
+            entry["resolved_at"] = time.time()
+            return entry["file_url"], None, entry["metadata"]
         versions = version_response.json()
         for version in versions:
             # Filter for compatible mod loader and Minecraft version
@@ -89,9 +215,18 @@ def get_download_url_modrinth(mod_name, mod_loader, mc_version):
                 file_url = version["files"][0]["url"]
                 metadata = {
                     "version_number": version["version_number"],
+                    "file_size": version["files"][0].get("size"),
                     "mod_loader": mod_loader,
                     "minecraft_version": mc_version
                 }
+                if cache is not None:
+                    cache[cache_key] = {
+                        "file_url": file_url,
+                        "metadata": metadata,
+                        "project_id": project_id,
+                        "etag": version_response.headers.get("ETag"),
+                        "resolved_at": time.time()
+                    }
                 return file_url, None, metadata
         logging.debug(f"No compatible version found for mod: {mod_name}")
         return None, "No compatible version found.", None
@@ -99,6 +234,53 @@ def get_download_url_modrinth(mod_name, mod_loader, mc_version):
         logging.error(f"Error fetching mod details: {e}")
         return None, str(e), None
 
+# Function to load the cache of previously resolved mods from the save directory
+def load_resolution_cache(save_directory):
+    cache_path = os.path.join(save_directory, CACHE_FILENAME)
+    try:
+        with open(cache_path, "rb") as cache_file:
+            cache = json_loads(cache_file.read())
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+# Function to persist the resolution cache to the save directory
+def save_resolution_cache(cache, save_directory):
+    cache_path = os.path.join(save_directory, CACHE_FILENAME)
+    with open(cache_path, "wb") as cache_file:
+        cache_file.write(json_dumps(cache))
+    logging.debug(f"Resolution cache saved to: {cache_path}")
+
+# Function to resolve the download URL for a mod list entry
+# Mods linked to Modrinth are looked up by slug, saving one search request per mod
+# Recently resolved mods are served from the cache without contacting the API
+def resolve_mod_modrinth(mod, mod_loader, mc_version, cache):
+    return get_download_url_modrinth(
+        mod["name"], mod_loader, mc_version, get_modrinth_slug(mod["url"]), cache, mod["url"]
+    )
+
+# Function to check whether a mod file is already fully downloaded at the expected version
+def is_up_to_date(save_path, metadata):
+    metadata_path = f"{save_path}.meta.json"
+    if not os.path.exists(save_path):
+        return False
+    expected_size = metadata.get("file_size")
+    if expected_size is not None and os.path.getsize(save_path) != expected_size:
+        return False
+    try:
+        with open(metadata_path, "rb") as meta_file:
+            return json_loads(meta_file.read()).get("version_number") == metadata["version_number"]
+    except (OSError, ValueError):
+        return False
+
+# Function to resolve hostnames ahead of time so the OS resolver cache is warm before workers connect
+def prefetch_dns(hosts):
+    for host in hosts:
+        try:
+            socket.getaddrinfo(host, 443, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            logging.debug(f"DNS prefetch failed for {host}: {e}")
+
 # Function to save the list of failed downloads to a log file
 def save_failed_downloads(failed_downloads, save_directory):
     failed_log = os.path.join(save_directory, "failed_downloads.log")
@@ -109,57 +291,97 @@ def save_failed_downloads(failed_downloads, save_directory):
     return failed_log
 
 # Main function to manage the downloading process
-def start_download(json_path, save_directory, mod_loader, mc_version, log_area, progress_bar):
+# Log and progress updates are posted to ui_queue and applied by the GUI thread
+def start_download(json_path, save_directory, mod_loader, mc_version, ui_queue, max_workers=DEFAULT_MAX_WORKERS):
     failed_downloads = []
     start_time = time.time()  # Record the start time of the process
 
     def log_message(message):
-        # Add a message to the log area and ensure it's scrolled to the bottom
-        log_area.insert(tk.END, message + "\n")
-        log_area.see(tk.END)
+        # Queue a message for the log area
+        ui_queue.put(("log", message))
         logging.info(message)
 
     def is_valid_url(url):
         # Validate the URL structure
-        parsed = urlparse(url)
-        return all([parsed.scheme, parsed.netloc])
+        return bool(URL_PATTERN.match(url))
 
     try:
         # Load the mod list from the specified JSON file
-        with open(json_path, "r") as file:
-            mod_list = json.load(file)
+        with open(json_path, "rb") as file:
+            mod_list = json_loads(file.read())
         if not isinstance(mod_list, list):
             log_message("Invalid JSON format. Expecting a list of mods.")
             return
 
-        progress_bar["maximum"] = len(mod_list)
-        progress_bar["value"] = 0
-
-        for index, mod in enumerate(mod_list):
+        valid_mods = []
+        seen_urls = {}  # Mod name -> URL of the first entry with that name
+        for mod in mod_list:
             if "name" in mod and "url" in mod and is_valid_url(mod["url"]):
-                mod_name = mod["name"]
-                mod_url, error, metadata = get_download_url_modrinth(mod_name, mod_loader, mc_version)
-                if not mod_url:
-                    log_message(f"Failed to resolve URL for {mod_name}: {error}")
-                    failed_downloads.append({"name": mod_name, "reason": error})
-                    progress_bar["value"] = index
-                    continue
-                save_path = os.path.join(save_directory, f"{mod_name}_{metadata['version_number']}_{mod_loader}.jar")
-                try:
-                    log_message(f"Downloading {mod_name} (Version: {metadata['version_number']})...")
-                    download_mod(mod_url, save_path, metadata)
-                    log_message(f"Successfully downloaded {mod_name}.")
-                except Exception as e:
-                    log_message(f"Failed to download {mod_name}: {e}")
-                    failed_downloads.append({"name": mod_name, "reason": str(e)})
-                progress_bar["value"] = index + 1  # Increment the progress bar for granular feedback
-                progress_bar.update_idletasks()
-                time.sleep(1)  # Introduce a short delay to avoid rate-limiting
+                # Only process each mod once, even if the list contains it several times
+                if mod["name"] not in seen_urls:
+                    seen_urls[mod["name"]] = mod["url"]
+                    valid_mods.append(mod)
+                elif seen_urls[mod["name"]] != mod["url"]:
+                    # Both entries would be saved to the same jar file, so only the first one is kept
+                    log_message(f"Skipping {mod['name']}: another entry with the same name has a different URL.")
+                    failed_downloads.append({"name": mod["name"], "reason": "Duplicate mod name with a different URL"})
             else:
                 log_message(f"Skipping invalid entry or malformed URL: {mod}")
                 failed_downloads.append({"name": mod.get("name", "Unknown"), "reason": "Missing required keys or invalid URL"})
+        duplicates = len(mod_list) - len(valid_mods) - len(failed_downloads)
+        if duplicates:
+            log_message(f"Skipped {duplicates} duplicate entries.")
+
+        skipped = len(mod_list) - len(valid_mods)
+        ui_queue.put(("maximum", len(mod_list)))
+        ui_queue.put(("progress", skipped))
+
+        def process_mod(mod):
+            # Resolve and download a single mod, returning a result dict for the main thread to report
+            # Any error is reported for this mod alone so the remaining mods are still logged and counted
+            mod_name = mod["name"]
+            try:
+                mod_url, error, metadata = resolve_mod_modrinth(mod, mod_loader, mc_version, cache)
+            except Exception as e:
+                logging.error(f"Unexpected error resolving {mod_name}: {e}")
+                return {"name": mod_name, "error": str(e), "message": f"Failed to resolve URL for {mod_name}: {e}"}
+            if not mod_url:
+                return {"name": mod_name, "error": error,
+                        "message": f"Failed to resolve URL for {mod_name}: {error}"}
+            try:
+                save_path = os.path.join(save_directory, f"{mod_name}_{metadata['version_number']}_{mod_loader}.jar")
+                if is_up_to_date(save_path, metadata):
+                    return {"name": mod_name, "error": None,
+                            "message": f"{mod_name} is already up to date (Version: {metadata['version_number']})."}
+                download_mod(mod_url, save_path, metadata)
+            except Exception as e:
+                return {"name": mod_name, "error": str(e), "message": f"Failed to download {mod_name}: {e}"}
+            return {"name": mod_name, "error": None,
+                    "message": f"Successfully downloaded {mod_name} (Version: {metadata['version_number']})."}
+
+        if valid_mods:
+            # Warm the resolver cache in the background so the worker pool doesn't wait on it
+            threading.Thread(target=prefetch_dns, args=(MODRINTH_HOSTS,), daemon=True).start()
+
+        # Downloads are network-bound, so overlap them across a small pool of workers
+        # Each worker downloads its mod as soon as it is resolved, while other mods are still being looked up
+        cache = load_resolution_cache(save_directory)
+        log_message(f"Processing {len(valid_mods)} mods from Modrinth...")
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(process_mod, mod) for mod in valid_mods]
+                for completed, future in enumerate(as_completed(futures), start=skipped + 1):
+                    result = future.result()
+                    log_message(result["message"])
+                    if result["error"]:
+                        failed_downloads.append({"name": result["name"], "reason": result["error"]})
+                    ui_queue.put(("progress", completed))  # Increment the progress bar for granular feedback
+        finally:
+            save_resolution_cache(cache, save_directory)
     except Exception as e:
         log_message(f"Error: {e}")
+    finally:
+        SESSION.close()  # Release pooled connections once the run is over
 
     if failed_downloads:
         # Save failed downloads to a log file
@@ -184,21 +406,52 @@ def browse_directory(entry_field):
         entry_field.insert(0, directory)
 
 # Wrapper to run the download process in a separate thread
-def start_download_threaded(json_entry, save_entry, mod_loader_box, mc_version_entry, log_area, progress_bar):
+# Widget values are read here, on the Tk thread, and only plain values are handed to the worker thread
+def start_download_threaded(json_entry, save_entry, mod_loader_box, mc_version_entry, max_workers_box, ui_queue):
+    json_path = json_entry.get()
+    save_directory = save_entry.get()
+    mod_loader = mod_loader_box.get()
+    mc_version = mc_version_entry.get()
+    try:
+        max_workers = min(max(int(max_workers_box.get()), 1), MAX_WORKERS_LIMIT)
+    except ValueError:
+        max_workers = DEFAULT_MAX_WORKERS
+
     def thread_target():
         try:
-            start_download(
-                json_entry.get(), save_entry.get(), mod_loader_box.get(),
-                mc_version_entry.get(), log_area, progress_bar
-            )
+            start_download(json_path, save_directory, mod_loader, mc_version, ui_queue, max_workers)
         except Exception as e:
             logging.error(f"Error in download thread: {e}")
-            log_area.insert(tk.END, f"Thread Error: {e}\n")
-            log_area.see(tk.END)
+            ui_queue.put(("log", f"Thread Error: {e}"))
     
     thread = threading.Thread(target=thread_target, daemon=True)
     thread.start()
 
+# Function to apply queued log and progress updates to the GUI, rescheduling itself periodically
+# Batching the updates keeps worker threads from waiting on Tk redraws
+def drain_ui_queue(root, ui_queue, log_area, progress_bar):
+    messages = []
+    progress_value = None
+    for _ in range(UI_DRAIN_BATCH_SIZE):
+        try:
+            kind, value = ui_queue.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "log":
+            messages.append(value)
+        elif kind == "maximum":
+            progress_bar.configure(maximum=value)
+            progress_value = None  # A new run resets the bar, so drop values from the previous one
+        elif kind == "progress":
+            progress_value = value if progress_value is None else max(progress_value, value)
+    if messages:
+        # One insert and one scroll per tick, however many messages arrived
+        log_area.insert(tk.END, "\n".join(messages) + "\n")
+        log_area.see(tk.END)
+    if progress_value is not None:
+        progress_bar.configure(value=progress_value)
+    root.after(UI_DRAIN_INTERVAL_MS, drain_ui_queue, root, ui_queue, log_area, progress_bar)
+
 # Helper function to create a label widget
 def create_label(root, text, row, column, **kwargs):
     tk.Label(root, text=text).grid(row=row, column=column, **kwargs)
@@ -240,6 +493,14 @@ def create_gui():
     mod_loader_box.grid(row=2, column=1, padx=10, pady=5)
     mod_loader_box.set("fabric")
 
+    max_workers_frame = tk.Frame(root)
+    max_workers_frame.grid(row=2, column=2, padx=10, pady=5)
+    tk.Label(max_workers_frame, text="Workers:").pack(side="left")
+    max_workers_box = tk.Spinbox(max_workers_frame, from_=1, to=MAX_WORKERS_LIMIT, width=3)
+    max_workers_box.pack(side="left")
+    max_workers_box.delete(0, tk.END)
+    max_workers_box.insert(0, DEFAULT_MAX_WORKERS)
+
     create_label(root, "Minecraft Version:", 3, 0, padx=10, pady=5, sticky="e")
     mc_version_entry = create_entry(root, 50, 3, 1, placeholder="e.g., 1.21.1", padx=10, pady=5)
 
@@ -248,8 +509,11 @@ def create_gui():
 
     progress_bar = create_progress_bar(root, 5, 0, columnspan=3, pady=10)
 
+    ui_queue = queue.Queue()
+    root.after(UI_DRAIN_INTERVAL_MS, drain_ui_queue, root, ui_queue, log_area, progress_bar)
+
     create_button(root, "Start", lambda: start_download_threaded(
-        json_entry, save_entry, mod_loader_box, mc_version_entry, log_area, progress_bar
+        json_entry, save_entry, mod_loader_box, mc_version_entry, max_workers_box, ui_queue
     ), 6, 1, pady=10)
 
     root.mainloop()